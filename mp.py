@@ -1,4 +1,4 @@
-from enum import Enum
+from enum import Enum, IntEnum
 
 INT_MAX_VALUE: int = (2**64) - 1
 BIN_MAX_LENGTH: int = (2**32) - 1
@@ -19,7 +19,7 @@ class MsgPackType(Enum):
     Ext = 8
 
 
-class MsgPackMarker(Enum):
+class MsgPackMarker(IntEnum):
     PositiveFixInt = 0x00
     NegativeFixInt = 0xE0
     FixMap = 0x80
@@ -1,181 +1,614 @@
 import struct
+import sys
+from math import isinf
+from array import array
 from io import BytesIO
-from typing import Dict, Hashable, List, TypeVar, Union
+from typing import Callable, Dict, Hashable, List, Optional, Set, TypeVar, Union
 
-from mp import MsgPackMarker, MsgPackType
+from mp import MsgPackMarker
 
 T = TypeVar("T")
 MappingType = Union[int, str, bool, float]
 
+_U8 = struct.Struct(">B").pack
+_HDR8 = struct.Struct(">BB").pack
+_HDR16 = struct.Struct(">BH").pack
+_HDR32 = struct.Struct(">BI").pack
+_HDR64 = struct.Struct(">BQ").pack
+_HDR_F32 = struct.Struct(">Bf").pack
+_HDR_F64 = struct.Struct(">Bd").pack
+
+
+def _fix_header(marker: int, length: int) -> bytes:
+    return _U8(marker | length)
+
+
+_VECTORIZE_MIN_LENGTH = 16
+_VECTORIZE_FLOAT_MIN_LENGTH = 96
+
+_NEGATIVE_FIXINT = 0xE0
+_FIXMAP = 0x80
+_FIXARRAY = 0x90
+_FIXSTR = 0xA0
+
+_M_NIL = 0xC0
+_M_FALSE = 0xC2
+_M_TRUE = 0xC3
+_M_BIN8 = 0xC4
+_M_BIN16 = 0xC5
+_M_BIN32 = 0xC6
+_M_FLOAT32 = 0xCA
+_M_FLOAT64 = 0xCB
+_M_UINT8 = 0xCC
+_M_UINT16 = 0xCD
+_M_UINT32 = 0xCE
+_M_UINT64 = 0xCF
+_M_INT8 = 0xD0
+_M_INT16 = 0xD1
+_M_INT32 = 0xD2
+_M_INT64 = 0xD3
+_M_STR8 = 0xD9
+_M_STR16 = 0xDA
+_M_STR32 = 0xDB
+_M_ARRAY16 = 0xDC
+_M_ARRAY32 = 0xDD
+_M_MAP16 = 0xDE
+_M_MAP32 = 0xDF
+
+
+def _write_str(buf: bytearray, value: str):
+    data: bytes = value.encode()
+    length: int = len(data)
+
+    if length <= 0x1F:
+        buf.append(_FIXSTR | length)
+    else:
+        _write_str_header(buf, length)
+    buf += data
+
+
+def _write_str_header(buf: bytearray, length: int):
+    if length <= 0xFF:
+        buf += _HDR8(_M_STR8, length)
+    elif length <= 0xFFFF:
+        buf += _HDR16(_M_STR16, length)
+    elif length <= 0xFFFFFFFF:
+        buf += _HDR32(_M_STR32, length)
+    else:
+        raise ValueError(
+            f"string value cannot be encoded, length {hex(length)} > 0xFFFFFFFF"
+        )
+
+
+def _write_bin(buf: bytearray, value: bytes):
+    length: int = len(value)
+
+    if length <= 0xFF:
+        buf += _HDR8(_M_BIN8, length)
+    elif length <= 0xFFFF:
+        buf += _HDR16(_M_BIN16, length)
+    elif length <= 0xFFFFFFFF:
+        buf += _HDR32(_M_BIN32, length)
+    else:
+        raise ValueError(
+            f"binary value cannot be encoded, length {hex(length)} > 0xFFFFFFFF"
+        )
+    buf += value
+
+
+_INT_MARKER_BY_BITLEN = (
+    (MsgPackMarker.PositiveFixInt,) * 8
+    + (MsgPackMarker.UInt8,) * 1
+    + (MsgPackMarker.UInt16,) * 8
+    + (MsgPackMarker.UInt32,) * 16
+    + (MsgPackMarker.UInt64,) * 32
+)
+_NEG_INT_MARKER_BY_BITLEN = (
+    (MsgPackMarker.NegativeFixInt,) * 6
+    + (MsgPackMarker.Int8,) * 2
+    + (MsgPackMarker.Int16,) * 8
+    + (MsgPackMarker.Int32,) * 16
+    + (MsgPackMarker.Int64,) * 32
+)
+
+
+# pushed under a container's items; the container sits below it on the stack
+_EXIT = object()
 
-class MPWrite:
-    def __init__(self, buffer: BytesIO):
-        self.buffer: BytesIO = buffer
-
-    def _write_pair(self, marker: MsgPackMarker, value: bytes):
-        self._write_marker(marker)
-        self._write_single(value)
 
-    def _write_marker(self, marker: MsgPackMarker):
-        self.buffer.write(struct.pack("<B", marker.value))
+class MPWrite:
+    def __init__(self, out: Optional[Union[bytearray, BytesIO]] = None):
+        # a BytesIO (the original API) is kept in sync with the bytearray
+        # whenever `buffer` is read or finalize() is called
+        self._stream: Optional[BytesIO] = None
+        self._synced: int = 0
+
+        if out is None:
+            out = bytearray()
+        elif isinstance(out, BytesIO):
+            self._stream = out
+            out = bytearray()
+        elif not isinstance(out, bytearray):
+            raise TypeError(
+                f"MPWrite writes into a bytearray or BytesIO, got {type(out).__name__}"
+            )
+
+        self._buf: bytearray = out
+
+    @property
+    def buffer(self) -> BytesIO:
+        if self._stream is None:
+            self._stream = BytesIO()
+        self._sync()
+        return self._stream
+
+    def finalize(self) -> bytes:
+        if self._stream is not None:
+            self._sync()
+        return bytes(self._buf)
+
+    def _sync(self):
+        if len(self._buf) > self._synced:
+            self._stream.write(self._buf[self._synced :])
+            self._synced = len(self._buf)
+
+    getvalue = finalize
 
     def _write_single(self, value: bytes):
-        self.buffer.write(value)
+        self._buf += value
+
+    def _write_sized(
+        self,
+        pack: Callable[[int, int], bytes],
+        marker: int,
+        value: bytes | bytearray,
+        max_length: int,
+    ):
+        length: int = len(value)
+        if length > max_length:
+            raise ValueError(
+                f"value cannot be encoded with marker {hex(marker)}, "
+                f"length {hex(length)} > {hex(max_length)}"
+            )
+
+        self._buf += pack(marker, length)
+        self._buf += value
 
     def _write_any(self, value: MappingType):
-        if isinstance(value, int):
-            assert (
-                value <= 0xFFFFFFFFFFFFFFFF
-            ), f"integer value cannot be encoded, {hex(value)} > 0xffffffffffffffff"
-
-            if value <= 0x7F:
-                self.write_integer(value, MsgPackMarker.PositiveFixInt)
-            elif value > 0x7F and value <= 0xFFFF:
-                self.write_integer(value, MsgPackMarker.UInt16)
-            elif value > 0xFFFF and value <= 0xFFFFFFFF:
-                self.write_integer(value, MsgPackMarker.UInt32)
+        self._write_values([value])
+
+    def _write_values(self, stack: List[MappingType]):
+        buf = self._buf
+        pop = stack.pop
+        push = stack.append
+        enter = self._enter_container
+        active: Set[int] = set()
+
+        while stack:
+            value = pop()
+            t = type(value)
+
+            if t is str:
+                data = value.encode()
+                length = len(data)
+                if length <= 0x1F:
+                    buf.append(_FIXSTR | length)
+                else:
+                    _write_str_header(buf, length)
+                buf += data
+            elif t is int:
+                if 0 <= value <= 0x7F:
+                    buf.append(value)
+                else:
+                    self._write_any_int(value)
+            elif t is dict:
+                length = len(value)
+                if length <= 0xF:
+                    buf.append(_FIXMAP | length)
+                else:
+                    self._write_map_header(length)
+                if length:
+                    enter(value, active, push)
+                    for k, v in reversed(value.items()):
+                        push(v)
+                        push(k)
+            elif t is list:
+                length = len(value)
+                if length <= 0xF:
+                    buf.append(_FIXARRAY | length)
+                else:
+                    self._write_array_header(length)
+                if not self._write_homogeneous(value):
+                    enter(value, active, push)
+                    stack.extend(reversed(value))
+            elif t is float:
+                buf += _HDR_F32(_M_FLOAT32, value)
+            elif t is bool:
+                buf.append(_M_TRUE if value else _M_FALSE)
+            elif value is None:
+                buf.append(_M_NIL)
+            elif t is bytes or t is bytearray:
+                _write_bin(buf, value)
+            elif value is _EXIT:
+                active.discard(id(pop()))
+            elif isinstance(value, dict):
+                enter(value, active, push)
+                push(dict(value.items()))
+            elif isinstance(value, list):
+                enter(value, active, push)
+                push(list(value))
             else:
-                self.write_integer(value, MsgPackMarker.UInt64)
-        elif isinstance(value, str):
-            length: int = len(value)
-
-            assert (
-                length < 0xFFFFFFFF
-            ), f"string value cannot be encoded, length {hex(length)} > 0xFFFFFFFF"
-
-            if length <= 0xFF:
-                self.write_str(value, MsgPackMarker.Str8)
-            elif length > 0xFF and length <= 0xFFFF:
-                self.write_str(value, MsgPackMarker.Str16)
-            elif length > 0xFFFF and length <= 0xFFFFFFFF:
-                self.write_str(value, MsgPackMarker.FixStr)
+                self._write_any_subclass(value)
+
+    def _enter_container(
+        self,
+        value: MappingType,
+        active: Set[int],
+        push: Callable[[MappingType], None],
+    ):
+        if id(value) in active:
+            raise ValueError(f'"{type(value)}" contains itself and cannot be encoded')
+
+        active.add(id(value))
+        push(value)
+        push(_EXIT)
+
+    def _write_any_subclass(self, value: MappingType):
+        for base, handler in _TYPE_DISPATCH.items():
+            if isinstance(value, base):
+                handler(self, value)
+                return
+
+        raise ValueError(f'"{type(value)}" cannot be encoded')
+
+    def _write_any_int(self, value: int):
+        try:
+            if value >= 0:
+                writer = _INT_WRITER_BY_BITLEN[value.bit_length()]
             else:
-                self.write_str(value, MsgPackMarker.Str32)
-        elif isinstance(value, float):
-            self.write_float(value, MsgPackMarker.Float32)
-        elif isinstance(value, bool):
-            self.write_bool(value)
-        elif isinstance(value, list):
-            arr_len: int = len(value)
-            arr_type = MsgPackMarker.FixArray
-
-            if arr_len > 0xF and arr_len <= 0xFFFF:
-                arr_type = MsgPackMarker.Array16
-            elif arr_len > 0xFFFF:
-                arr_type = MsgPackMarker.Array32
-            self.write_array(value, arr_type)
-        elif isinstance(value, dict):
-            self.write_map(value)
-        elif value is None:
-            self.write_nil()
-        else:
-            raise ValueError(f'"{type(value)}" cannot be encoded')
-
-    def write_integer(self, value: int, t: MsgPackType):
-        assert t not in MsgPackType, "invalid msgpack type in `write_integer'"
-
-        match t:
-            case MsgPackMarker.PositiveFixInt:
-                self._write_single(struct.pack("B", t.value | (value & 0x7F)))
-            case MsgPackMarker.NegativeFixInt:
-                self._write_single(struct.pack("B", t.value | (value & 0x1F)))
-            case MsgPackMarker.UInt8 | MsgPackMarker.Int8:
-                self._write_pair(t, struct.pack("b", value & 0xFF))
-            case MsgPackMarker.UInt16 | MsgPackMarker.Int16:
-                self._write_pair(t, struct.pack(">H", value & 0xFFFF))
-            case MsgPackMarker.UInt32 | MsgPackMarker.Int32:
-                self._write_pair(t, struct.pack(">I", value & 0xFFFFFFFF))
-            case MsgPackMarker.UInt64 | MsgPackMarker.Int64:
-                self._write_pair(t, struct.pack(">Q", value & 0xFFFFFFFFFFFFFFFF))
-
-    def write_float(self, value: float, t: MsgPackType):
-        assert t not in MsgPackType, "invalid msgpack type in `write_float'"
-
-        match t:
-            case MsgPackMarker.Float32:
-                self._write_pair(t, struct.pack(">f", value))
-            case MsgPackMarker.Float64:
-                self._write_pair(t, struct.pack(">d", value))
+                writer = _NEG_INT_WRITER_BY_BITLEN[(~value).bit_length()]
+        except IndexError:
+            raise ValueError(
+                f"integer value cannot be encoded, {hex(value)} does not fit in 64 bits"
+            ) from None
 
-    def write_str(self, value: str | bytearray, t: MsgPackType):
-        assert t not in MsgPackType, "invalid msgpack type in `write_str'"
+        writer(self, value)
 
-        length: int = len(value)
-        match t:
-            case MsgPackMarker.FixStr:
-                self._write_single(struct.pack(">B", t.value | (length & 0x1F)))
-                self._write_single(value[: length & 0xFFFFFFFF].encode("utf8"))
-            case MsgPackMarker.Str8 | MsgPackMarker.Bin8:
-                self._write_marker(t)
-                self._write_single(struct.pack(">B", length & 0xFF))
-                if isinstance(value, str):
-                    self._write_single(value[: length & 0xFF].encode("utf8"))
-                else:
-                    self._write_single(value[: length & 0xFF])
-            case MsgPackMarker.Str16 | MsgPackMarker.Bin16:
-                self._write_marker(t)
-                self._write_single(struct.pack(">H", length & 0xFFFF))
-                if isinstance(value, str):
-                    self._write_single(value[: length & 0xFFFF].encode("utf8"))
-                else:
-                    self._write_single(value[: length & 0xFFFF])
-            case MsgPackMarker.Str32 | MsgPackMarker.Bin32:
-                self._write_marker(t)
-                self._write_single(struct.pack(">I", length & 0xFFFFFFFF))
-                if isinstance(value, str):
-                    self._write_single(value[: length & 0xFFFFFFFF].encode("utf8"))
-                else:
-                    self._write_single(value[: length & 0xFFFFFFFF])
+    def _write_any_str(self, value: str):
+        _write_str(self._buf, value)
+
+    def _write_array_header(self, length: int):
+        if length <= 0xF:
+            self._buf.append(_FIXARRAY | length)
+        elif length <= 0xFFFF:
+            self._buf += _HDR16(_M_ARRAY16, length)
+        elif length <= 0xFFFFFFFF:
+            self._buf += _HDR32(_M_ARRAY32, length)
+        else:
+            raise ValueError(
+                f"array cannot be encoded, length {hex(length)} > 0xFFFFFFFF"
+            )
+
+    def _write_map_header(self, length: int):
+        if length <= 0xF:
+            self._buf.append(_FIXMAP | length)
+        elif length <= 0xFFFF:
+            self._buf += _HDR16(_M_MAP16, length)
+        elif length <= 0xFFFFFFFF:
+            self._buf += _HDR32(_M_MAP32, length)
+        else:
+            raise ValueError(
+                f"dictionary/mapping cannot be encoded, length {hex(length)} > 0xFFFFFFFF"
+            )
+
+    def _write_items(self, arr: List[T]):
+        if not self._write_homogeneous(arr):
+            self._write_values(arr[::-1])
+
+    def _write_homogeneous(self, arr: List[T]) -> bool:
+        if not arr:
+            return True
+
+        first_ty = type(arr[0])
+        writer = _HOMOGENEOUS_WRITERS.get(first_ty)
+        if writer is None or not all(type(elm) is first_ty for elm in arr):
+            return False
+
+        writer(self, arr)
+        return True
+
+    def _write_int_array(self, arr: List[int]):
+        buf = self._buf
+
+        if len(arr) >= _VECTORIZE_MIN_LENGTH:
+            # converting first and rejecting 0x80..0xFF afterwards beats a
+            # min()/max() pre-check even though that case allocates twice
+            try:
+                data = bytes(arr)
+            except ValueError:
+                pass
+            else:
+                if data.isascii():
+                    buf += data
+                    return
 
-    def write_bin(self, value: bytearray, t: MsgPackType):
+        for value in arr:
+            if 0 <= value <= 0x7F:
+                buf.append(value)
+            else:
+                self._write_any_int(value)
+
+    def _write_str_array(self, arr: List[str]):
+        buf = self._buf
+        for value in arr:
+            data = value.encode()
+            length = len(data)
+            if length <= 0x1F:
+                buf.append(_FIXSTR | length)
+            else:
+                _write_str_header(buf, length)
+            buf += data
+
+    def _write_float_array(self, arr: List[float]):
+        buf = self._buf
+
+        if len(arr) >= _VECTORIZE_FLOAT_MIN_LENGTH:
+            packed = array("f", arr)
+            # array() saturates to inf where struct raises; let the loop decide
+            if not any(map(isinf, packed)):
+                if sys.byteorder == "little":
+                    packed.byteswap()
+                data = packed.tobytes()
+                length = len(arr)
+                out = bytearray(5 * length)
+                out[0::5] = bytes((_M_FLOAT32,)) * length
+                for i in range(4):
+                    out[i + 1 :: 5] = data[i::4]
+                buf += out
+                return
+
+        for value in arr:
+            buf += _HDR_F32(_M_FLOAT32, value)
+
+    def write_integer(self, value: int, t: MsgPackMarker):
+        writer = _INT_WRITERS.get(t)
+        if writer is None:
+            raise TypeError(f"invalid msgpack marker {t!r} in `write_integer'")
+
+        writer(self, value)
+
+    def write_float(self, value: float, t: MsgPackMarker):
+        writer = _FLOAT_WRITERS.get(t)
+        if writer is None:
+            raise TypeError(f"invalid msgpack marker {t!r} in `write_float'")
+
+        writer(self, value)
+
+    def write_str(self, value: str | bytearray, t: MsgPackMarker):
+        writer = _STR_WRITERS.get(t)
+        if writer is None:
+            raise TypeError(f"invalid msgpack marker {t!r} in `write_str'")
+
+        if isinstance(value, str):
+            value = value.encode()
+        writer(self, value)
+
+    def write_bin(self, value: bytearray, t: MsgPackMarker):
         return self.write_str(value, t)
 
     def write_bool(self, value: bool):
-        self._write_marker(MsgPackMarker.BoolTrue if value else MsgPackMarker.BoolFalse)
+        self._buf.append(_M_TRUE if value else _M_FALSE)
 
     def write_nil(self):
-        self._write_marker(MsgPackMarker.Nil)
-
-    def write_array(self, arr: List[T], t: MsgPackType):
-        length: int = len(arr)
-        match t:
-            case MsgPackMarker.FixArray:
-                length &= 0xF
-                self._write_single(struct.pack(">B", t.value | length))
-            case MsgPackMarker.Array16:
-                length &= 0xFFFF
-                self._write_marker(t)
-                self._write_single(struct.pack(">H", length))
-            case MsgPackMarker.Array32:
-                length &= 0xFFFFFFFF
-                self._write_marker(t)
-                self._write_single(struct.pack(">I", length))
-
-        for elm in arr:
-            self._write_any(elm)
+        self._buf.append(_M_NIL)
 
-    def write_map(self, value: Dict[Hashable, MappingType]):
-        length: int = len(value)
+    def write_array(self, arr: List[T], t: MsgPackMarker):
+        writer = _ARR_WRITERS.get(t)
+        if writer is None:
+            raise TypeError(f"invalid msgpack marker {t!r} in `write_array'")
 
-        assert (
-            length <= 0xFFFFFFFF
-        ), f"dictionary/mapping cannot be encoded, length {hex(length)} > 0xFFFFFFFF"
+        writer(self, len(arr))
 
-        if length <= 0xF:
-            length &= 0xF
-            self._write_single(struct.pack(">B", MsgPackMarker.FixMap.value | length))
-        elif length > 0xF and length <= 0xFFFF:
-            length &= 0xFFFF
-            self._write_marker(MsgPackMarker.Map16)
-            self._write_single(struct.pack(">H", length))
-        else:
-            length &= 0xFFFFFFFF
-            self._write_marker(MsgPackMarker.Map32)
-            self._write_single(struct.pack(">I", length))
+        self._write_items(arr)
 
-        for k, v in value.items():
-            self._write_any(k)
-            self._write_any(v)
+    def write_map(self, value: Dict[Hashable, MappingType]):
+        self._write_map_header(len(value))
+
+        stack: List[MappingType] = []
+        for k, v in reversed(value.items()):
+            stack.append(v)
+            stack.append(k)
+        self._write_values(stack)
+
+
+_INT_WRITERS: Dict[MsgPackMarker, Callable[[MPWrite, int], None]] = {
+    MsgPackMarker.PositiveFixInt: lambda self, v: self._buf.append(v & 0x7F),
+    MsgPackMarker.NegativeFixInt: lambda self, v: self._buf.append(
+        _NEGATIVE_FIXINT | (v & 0x1F)
+    ),
+    MsgPackMarker.UInt8: lambda self, v: self._write_single(_HDR8(_M_UINT8, v & 0xFF)),
+    MsgPackMarker.Int8: lambda self, v: self._write_single(_HDR8(_M_INT8, v & 0xFF)),
+    MsgPackMarker.UInt16: lambda self, v: self._write_single(
+        _HDR16(_M_UINT16, v & 0xFFFF)
+    ),
+    MsgPackMarker.Int16: lambda self, v: self._write_single(
+        _HDR16(_M_INT16, v & 0xFFFF)
+    ),
+    MsgPackMarker.UInt32: lambda self, v: self._write_single(
+        _HDR32(_M_UINT32, v & 0xFFFFFFFF)
+    ),
+    MsgPackMarker.Int32: lambda self, v: self._write_single(
+        _HDR32(_M_INT32, v & 0xFFFFFFFF)
+    ),
+    MsgPackMarker.UInt64: lambda self, v: self._write_single(
+        _HDR64(_M_UINT64, v & 0xFFFFFFFFFFFFFFFF)
+    ),
+    MsgPackMarker.Int64: lambda self, v: self._write_single(
+        _HDR64(_M_INT64, v & 0xFFFFFFFFFFFFFFFF)
+    ),
+}
+
+_INT_WRITER_BY_BITLEN = tuple(_INT_WRITERS[m] for m in _INT_MARKER_BY_BITLEN)
+_NEG_INT_WRITER_BY_BITLEN = tuple(_INT_WRITERS[m] for m in _NEG_INT_MARKER_BY_BITLEN)
+
+_FLOAT_WRITERS: Dict[MsgPackMarker, Callable[[MPWrite, float], None]] = {
+    MsgPackMarker.Float32: lambda self, v: self._write_single(_HDR_F32(_M_FLOAT32, v)),
+    MsgPackMarker.Float64: lambda self, v: self._write_single(_HDR_F64(_M_FLOAT64, v)),
+}
+
+_STR_WRITERS: Dict[MsgPackMarker, Callable[[MPWrite, bytes | bytearray], None]] = {
+    MsgPackMarker.FixStr: lambda self, v: self._write_sized(
+        _fix_header, _FIXSTR, v, 0x1F
+    ),
+    MsgPackMarker.Str8: lambda self, v: self._write_sized(_HDR8, _M_STR8, v, 0xFF),
+    MsgPackMarker.Bin8: lambda self, v: self._write_sized(_HDR8, _M_BIN8, v, 0xFF),
+    MsgPackMarker.Str16: lambda self, v: self._write_sized(_HDR16, _M_STR16, v, 0xFFFF),
+    MsgPackMarker.Bin16: lambda self, v: self._write_sized(_HDR16, _M_BIN16, v, 0xFFFF),
+    MsgPackMarker.Str32: lambda self, v: self._write_sized(
+        _HDR32, _M_STR32, v, 0xFFFFFFFF
+    ),
+    MsgPackMarker.Bin32: lambda self, v: self._write_sized(
+        _HDR32, _M_BIN32, v, 0xFFFFFFFF
+    ),
+}
+
+_ARR_WRITERS: Dict[MsgPackMarker, Callable[[MPWrite, int], None]] = {
+    MsgPackMarker.FixArray: lambda self, n: self._buf.append(_FIXARRAY | (n & 0xF)),
+    MsgPackMarker.Array16: lambda self, n: self._write_single(
+        _HDR16(_M_ARRAY16, n & 0xFFFF)
+    ),
+    MsgPackMarker.Array32: lambda self, n: self._write_single(
+        _HDR32(_M_ARRAY32, n & 0xFFFFFFFF)
+    ),
+}
+
+_TYPE_DISPATCH: Dict[type, Callable[[MPWrite, MappingType], None]] = {
+    bool: MPWrite.write_bool,
+    int: MPWrite._write_any_int,
+    str: MPWrite._write_any_str,
+    float: lambda self, v: self._write_single(_HDR_F32(_M_FLOAT32, v)),
+    type(None): lambda self, v: self.write_nil(),
+    bytes: lambda self, v: _write_bin(self._buf, v),
+    bytearray: lambda self, v: _write_bin(self._buf, v),
+}
+
+_HOMOGENEOUS_WRITERS: Dict[type, Callable[[MPWrite, List], None]] = {
+    int: MPWrite._write_int_array,
+    str: MPWrite._write_str_array,
+    float: MPWrite._write_float_array,
+}
+
+
+def encode(obj: MappingType) -> bytes:
+    m = MPWrite()
+    m._write_any(obj)
+    return m.finalize()
+
+
+def encode_into(obj: MappingType, out: bytearray, offset: int = 0):
+    start = len(out)
+    if offset == -1:
+        offset = start
+    elif offset < -1:
+        raise ValueError(f"offset must be >= -1, got {offset}")
+
+    try:
+        if offset > start:
+            out += bytes(offset - start)
+        MPWrite(out)._write_any(obj)
+    except BaseException:
+        del out[start:]
+        raise
+
+    if offset < start:
+        del out[offset:start]
+
+
+class Encoder:
+    # every call writes into its own buffer, so an Encoder can be shared
+    # between threads
+    def encode(self, obj: MappingType) -> bytes:
+        return encode(obj)
+
+    def encode_into(self, obj: MappingType, out: bytearray, offset: int = 0):
+        encode_into(obj, out, offset)
+
+
+_SCHEMA_FALLBACK = "    MPWrite(buf)._write_any(v)"
+
+_SCHEMA_FIELD_WRITERS: Dict[type, str] = {
+    int: (
+        "    if type(v) is int and 0 <= v <= 0x7F:\n"
+        "        buf.append(v)\n"
+        "    else:\n"
+        "    " + _SCHEMA_FALLBACK
+    ),
+    str: (
+        "    if type(v) is str:\n"
+        "        _write_str(buf, v)\n"
+        "    else:\n"
+        "    " + _SCHEMA_FALLBACK
+    ),
+    float: (
+        "    if type(v) is float:\n"
+        "        buf += _HDR_F32(_M_FLOAT32, v)\n"
+        "    else:\n"
+        "    " + _SCHEMA_FALLBACK
+    ),
+    bool: (
+        "    if v is True:\n"
+        "        buf.append(_M_TRUE)\n"
+        "    elif v is False:\n"
+        "        buf.append(_M_FALSE)\n"
+        "    else:\n"
+        "    " + _SCHEMA_FALLBACK
+    ),
+    bytes: (
+        "    if type(v) is bytes:\n"
+        "        _write_bin(buf, v)\n"
+        "    else:\n"
+        "    " + _SCHEMA_FALLBACK
+    ),
+    list: _SCHEMA_FALLBACK,
+    dict: _SCHEMA_FALLBACK,
+    type(None): _SCHEMA_FALLBACK,
+}
+
+
+def make_encoder(schema: Dict[str, type]) -> Callable[[Dict[str, MappingType]], bytes]:
+    static = MPWrite()
+    static._write_map_header(len(schema))
+
+    lines = ["def encode_record(d):", "    buf = bytearray()"]
+    for key, ty in schema.items():
+        if type(key) is not str:
+            raise TypeError(f"schema keys must be str, got {type(key)}")
+
+        writer = _SCHEMA_FIELD_WRITERS.get(ty)
+        if writer is None:
+            raise TypeError(f"schema field {key!r} has unsupported type {ty!r}")
+
+        static._write_any(key)
+        lines.append(f"    buf += {static.finalize()!r}")
+        static._buf.clear()
+
+        lines.append(f"    v = d[{key!r}]")
+        lines.append(writer)
+    if not schema:
+        lines.append(f"    buf += {static.finalize()!r}")
+    lines.append("    return bytes(buf)")
+
+    namespace = {
+        "MPWrite": MPWrite,
+        "_write_str": _write_str,
+        "_write_bin": _write_bin,
+        "_HDR_F32": _HDR_F32,
+        "_M_FLOAT32": _M_FLOAT32,
+        "_M_TRUE": _M_TRUE,
+        "_M_FALSE": _M_FALSE,
+    }
+    exec("\n".join(lines), namespace)
+    return namespace["encode_record"]
 
 
 class MPRead:
@@ -189,8 +622,6 @@ class MPRead:
         byte = self._read_and_advance()
         value = int.from_bytes(byte, "little")
 
-        print(byte, self.buffer.getvalue().hex())
-
         if (value & 0x80) == 0:
             return struct.unpack("B", byte)[0] & 0x7F
         elif (value & 0xE0) == 0xE0:
@@ -198,9 +629,9 @@ class MPRead:
 
         match MsgPackMarker(value):
             case MsgPackMarker.UInt8:
-                return struct.unpack("B", self._read_and_advance())
+                return struct.unpack("B", self._read_and_advance())[0]
             case MsgPackMarker.Int8:
-                return struct.unpack("b", self._read_and_advance())
+                return struct.unpack("b", self._read_and_advance())[0]
             case MsgPackMarker.UInt16:
                 return struct.unpack(">H", self._read_and_advance(2))[0]
             case MsgPackMarker.Int16:
@@ -223,34 +654,30 @@ class MPRead:
 
 
 def test_int():
-    m = MPWrite(BytesIO())
+    m = MPWrite()
 
     m.write_integer(45, MsgPackMarker.PositiveFixInt)
-    assert m.buffer.getvalue().hex() == "2d"
+    assert m.finalize().hex() == "2d"
 
     m.write_integer(-12, MsgPackMarker.NegativeFixInt)
-    assert m.buffer.getvalue().hex() == "2df4"
+    assert m.finalize().hex() == "2df4"
 
     m.write_integer(65538, MsgPackMarker.UInt16)
-    assert m.buffer.getvalue().hex() == "2df4cd0002"
+    assert m.finalize().hex() == "2df4cd0002"
 
     m.write_integer(4294967295, MsgPackMarker.UInt32)
-    assert m.buffer.getvalue().hex() == "2df4cd0002ceffffffff"
+    assert m.finalize().hex() == "2df4cd0002ceffffffff"
 
     m.write_integer(4294967297, MsgPackMarker.UInt32)
-    assert m.buffer.getvalue().hex() == "2df4cd0002ceffffffffce00000001"
+    assert m.finalize().hex() == "2df4cd0002ceffffffffce00000001"
 
     m.write_integer(2147483645, MsgPackMarker.Int32)
-    assert m.buffer.getvalue().hex() == "2df4cd0002ceffffffffce00000001d27ffffffd"
+    assert m.finalize().hex() == "2df4cd0002ceffffffffce00000001d27ffffffd"
 
     m.write_integer(2147483649, MsgPackMarker.Int32)
-    assert (
-        m.buffer.getvalue().hex()
-        == "2df4cd0002ceffffffffce00000001d27ffffffdd280000001"
-    )
+    assert m.finalize().hex() == "2df4cd0002ceffffffffce00000001d27ffffffdd280000001"
 
     mr = MPRead(m.buffer)
-
     m.buffer.seek(0)
 
     assert mr.read_int() == 45
@@ -259,21 +686,51 @@ def test_int():
     assert mr.read_int() == 4294967295
     assert mr.read_int() == 1
 
+    m = MPWrite()
+
+    m.write_integer(200, MsgPackMarker.UInt8)
+    assert m.finalize().hex() == "ccc8"
+
+    m = MPWrite()
+
+    m.write_integer(0x1234, 0xCD)
+    assert m.finalize().hex() == "cd1234"
+
+    m = MPWrite()
+
+    for value in (0x7F, 0x80, 0x100, 0x10000, 0x100000000, -1, -32, -33, -129):
+        m._write_any(value)
+    assert (
+        m.finalize().hex() == "7fcc80cd0100ce00010000cf0000000100000000ffe0d0dfd1ff7f"
+    )
+
+    mr = MPRead(m.buffer)
+    m.buffer.seek(0)
+
+    assert mr.read_int() == 0x7F
+    assert mr.read_int() == 0x80
+    assert mr.read_int() == 0x100
+    assert mr.read_int() == 0x10000
+    assert mr.read_int() == 0x100000000
+    assert mr.read_int() == -1
+    assert mr.read_int() == -32
+    assert mr.read_int() == -33
+    assert mr.read_int() == -129
+
 
 def test_float():
     m = MPWrite(BytesIO())
 
     m.write_float(3.14, MsgPackMarker.Float32)
-    assert m.buffer.getvalue().hex() == "ca4048f5c3"
+    assert m.finalize().hex() == "ca4048f5c3"
 
     m.write_float(5.99998, MsgPackMarker.Float32)
-    assert m.buffer.getvalue().hex() == "ca4048f5c3ca40bfffd6"
+    assert m.finalize().hex() == "ca4048f5c3ca40bfffd6"
 
     m.write_float(987.981, MsgPackMarker.Float32)
     assert m.buffer.getvalue().hex() == "ca4048f5c3ca40bfffd6ca4476fec9"
 
     mr = MPRead(m.buffer)
-
     m.buffer.seek(0)
 
     assert mr.read_float() == 3.140000104904175
@@ -282,10 +739,10 @@ def test_float():
 
 
 def test_str():
-    m = MPWrite(BytesIO())
+    m = MPWrite()
 
     m.write_str("Hello world", MsgPackMarker.FixStr)
-    assert m.buffer.getvalue().hex() == "ab48656c6c6f20776f726c64"
+    assert m.finalize().hex() == "ab48656c6c6f20776f726c64"
 
     LI: str = (
         "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt ut labore et dolore magna aliqua."
@@ -296,7 +753,7 @@ def test_str():
 
     m.write_str(LI, MsgPackMarker.Str16)
     assert (
-        m.buffer.getvalue().hex()
+        m.finalize().hex()
         == "ab48656c6c6f20776f726c64da01ba4c6f72656d20697073756d20646f6c6f722073697420616d65742c20636f6e73656374657475722061646970697363696e6720656c69742c2073656420646f20656975736d6f642074656d706f7220696e6369646964756e74207574206c61626f726520657420646f6c6f7265206d61676e6120616c697175612e557420656e696d206164206d696e696d2076656e69616d2c2071756973206e6f737472756420657865726369746174696f6e20756c6c616d636f206c61626f726973206e69736920757420616c697175697020657820656120636f6d6d6f646f20636f6e7365717561742e44756973206175746520697275726520646f6c6f7220696e20726570726568656e646572697420696e20766f6c7570746174652076656c697420657373652063696c6c756d20646f6c6f726520657520667567696174206e756c6c612070617269617475722e4578636570746575722073696e74206f6363616563617420637570696461746174206e6f6e2070726f6964656e742c2073756e7420696e2063756c706120717569206f666669636961206465736572756e74206d6f6c6c697420616e696d20696420657374206c61626f72756d2e"
     )
 
@@ -307,29 +764,29 @@ def test_str():
 
     m.write_str(LI_ru, MsgPackMarker.Str16)
     assert (
-        m.buffer.getvalue().hex()
-        == "ab48656c6c6f20776f726c64da01ba4c6f72656d20697073756d20646f6c6f722073697420616d65742c20636f6e73656374657475722061646970697363696e6720656c69742c2073656420646f20656975736d6f642074656d706f7220696e6369646964756e74207574206c61626f726520657420646f6c6f7265206d61676e6120616c697175612e557420656e696d206164206d696e696d2076656e69616d2c2071756973206e6f737472756420657865726369746174696f6e20756c6c616d636f206c61626f726973206e69736920757420616c697175697020657820656120636f6d6d6f646f20636f6e7365717561742e44756973206175746520697275726520646f6c6f7220696e20726570726568656e646572697420696e20766f6c7570746174652076656c697420657373652063696c6c756d20646f6c6f726520657520667567696174206e756c6c612070617269617475722e4578636570746575722073696e74206f6363616563617420637570696461746174206e6f6e2070726f6964656e742c2073756e7420696e2063756c706120717569206f666669636961206465736572756e74206d6f6c6c697420616e696d20696420657374206c61626f72756d2eda00bcd094d0b0d0b2d0bdd0be20d0b2d18bd18fd181d0bdd0b5d0bdd0be2c20d187d182d0be20d0bfd180d0b820d0bed186d0b5d0bdd0bad0b520d0b4d0b8d0b7d0b0d0b9d0bdd0b020d0b820d0bad0bed0bcd0bfd0bed0b7d0b8d186d0b8d0b820d187d0b8d182d0b0d0b5d0bcd18bd0b920d182d0b5d0bad181d18220d0bcd0b5d188d0b0d0b5d18220d181d0bed181d180d0b5d0b4d0bed182d0bed187d0b8d182d18cd181d18f2e4c6f72656d20497073756d20d0b8d181d0bfd0bed0bbd18cd0b7d183d18ed18220d0bfd0bed182d0bed0bcd1832c20d187d182d0be20d182d0bed18220d0bed0b1d0b5d181d0bfd0b5d187d0b8d0b2d0b0d0b5d18220d0b1d0bed0bbd0b5d0b520d0b8d0bbd0b820d0bcd0b5d0bdd0b5d0b520d181d182d0b0d0bdd0b4d0b0d180d182d0bdd0bed0b520d0b7d0b0d0bfd0bed0bbd0bdd0b5d0bdd0b8d0b520d188d0b0d0b1d0bbd0bed0bdd0b0"
+        m.finalize().hex()
+        == "ab48656c6c6f20776f726c64da01ba4c6f72656d20697073756d20646f6c6f722073697420616d65742c20636f6e73656374657475722061646970697363696e6720656c69742c2073656420646f20656975736d6f642074656d706f7220696e6369646964756e74207574206c61626f726520657420646f6c6f7265206d61676e6120616c697175612e557420656e696d206164206d696e696d2076656e69616d2c2071756973206e6f737472756420657865726369746174696f6e20756c6c616d636f206c61626f726973206e69736920757420616c697175697020657820656120636f6d6d6f646f20636f6e7365717561742e44756973206175746520697275726520646f6c6f7220696e20726570726568656e646572697420696e20766f6c7570746174652076656c697420657373652063696c6c756d20646f6c6f726520657520667567696174206e756c6c612070617269617475722e4578636570746575722073696e74206f6363616563617420637570696461746174206e6f6e2070726f6964656e742c2073756e7420696e2063756c706120717569206f666669636961206465736572756e74206d6f6c6c697420616e696d20696420657374206c61626f72756d2eda0154d094d0b0d0b2d0bdd0be20d0b2d18bd18fd181d0bdd0b5d0bdd0be2c20d187d182d0be20d0bfd180d0b820d0bed186d0b5d0bdd0bad0b520d0b4d0b8d0b7d0b0d0b9d0bdd0b020d0b820d0bad0bed0bcd0bfd0bed0b7d0b8d186d0b8d0b820d187d0b8d182d0b0d0b5d0bcd18bd0b920d182d0b5d0bad181d18220d0bcd0b5d188d0b0d0b5d18220d181d0bed181d180d0b5d0b4d0bed182d0bed187d0b8d182d18cd181d18f2e4c6f72656d20497073756d20d0b8d181d0bfd0bed0bbd18cd0b7d183d18ed18220d0bfd0bed182d0bed0bcd1832c20d187d182d0be20d182d0bed18220d0bed0b1d0b5d181d0bfd0b5d187d0b8d0b2d0b0d0b5d18220d0b1d0bed0bbd0b5d0b520d0b8d0bbd0b820d0bcd0b5d0bdd0b5d0b520d181d182d0b0d0bdd0b4d0b0d180d182d0bdd0bed0b520d0b7d0b0d0bfd0bed0bbd0bdd0b5d0bdd0b8d0b520d188d0b0d0b1d0bbd0bed0bdd0b0"
     )
 
 
 def test_bin():
-    m = MPWrite(BytesIO())
+    m = MPWrite()
 
     m.write_bin(bytearray(range(32)), MsgPackMarker.Bin8)
     assert (
-        m.buffer.getvalue().hex()
+        m.finalize().hex()
         == "c420000102030405060708090a0b0c0d0e0f101112131415161718191a1b1c1d1e1f"
     )
 
     m.write_bin(b"\x41\x41\x41\x41\x41", MsgPackMarker.Bin16)
     assert (
-        m.buffer.getvalue().hex()
+        m.finalize().hex()
         == "c420000102030405060708090a0b0c0d0e0f101112131415161718191a1b1c1d1e1fc500054141414141"
     )
 
 
 def test_array():
-    m = MPWrite(BytesIO())
+    m = MPWrite()
 
     values: List[object] = [
         0xCA,
@@ -347,13 +804,35 @@ def test_array():
 
     m.write_array(values, MsgPackMarker.Array16)
     assert (
-        m.buffer.getvalue().hex()
-        == "dc000bcd00cacd00fecd00bacd00bed90b48656c6c6f20776f726c64d9023435c0c0ca3fcf1aa0ca4048f5c381d90568656c6c6fd905776f726c64"
+        m.finalize().hex()
+        == "dc000bcccaccfeccbaccbeab48656c6c6f20776f726c64a23435c0c0ca3fcf1aa0ca4048f5c381a568656c6c6fa5776f726c64"
+    )
+
+    assert encode([1, 200, -5]).hex() == "9301ccc8fb"
+    assert encode(["a", "b" * 32]).hex() == "92a161d920" + "62" * 32
+    assert encode([0.5, 1.5]).hex() == "92ca3f000000ca3fc00000"
+    assert encode([1, True, 2.0]).hex() == "9301c3ca40000000"
+
+    ints = list(range(20))
+    assert encode(ints).hex() == "dc0014" + bytes(ints).hex()
+    assert encode(ints + [128]).hex() == "dc0015" + bytes(ints).hex() + "cc80"
+
+    floats = [i / 3 for i in range(100)]
+    assert encode(floats) == b"\xdc\x00\x64" + b"".join(
+        b"\xca" + struct.pack(">f", f) for f in floats
     )
 
+    straddle = struct.unpack("<f", b"\x80\x7f\x80\x3f")[0]
+    for length in (_VECTORIZE_FLOAT_MIN_LENGTH, _VECTORIZE_FLOAT_MIN_LENGTH + 1, 1000):
+        values = ([0.0, straddle, -1.5, 1e-40] * length)[:length]
+        assert encode(values) == _HDR16(_M_ARRAY16, length) + b"".join(
+            b"\xca" + struct.pack(">f", f) for f in values
+        )
+    assert encode(floats + [float("inf")]).endswith(b"\xca\x7f\x80\x00\x00")
+
 
 def test_mapping():
-    m = MPWrite(BytesIO())
+    m = MPWrite()
 
     values: Dict[Hashable, MappingType] = {
         "Hello": "World",
@@ -366,6 +845,103 @@ def test_mapping():
 
     m.write_map(values)
     assert (
-        m.buffer.getvalue().hex()
-        == "86d90548656c6c6fd905576f726c64d9014193d90142d90143d90144d9047573657281d903616263d903636261d909636f6e6e656374656400d90d61757468656e7469636174656401d90870617373776f7264c0"
+        m.finalize().hex()
+        == "86a548656c6c6fa5576f726c64a14193a142a143a144a47573657281a3616263a3636261a9636f6e6e6563746564c2ad61757468656e74696361746564c3a870617373776f7264c0"
+    )
+
+
+def test_encode():
+    assert encode({"a": [1, None]}).hex() == "81a1619201c0"
+
+    out = bytearray(b"\xff\xff")
+    encode_into("ab", out, 1)
+    assert out.hex() == "ffa26162"
+
+    encode_into(None, out, -1)
+    assert out.hex() == "ffa26162c0"
+
+    out = bytearray(b"\xff")
+    encode_into(None, out, 3)
+    assert out.hex() == "ff0000c0"
+
+    assert encode([True, False, 1, 0]).hex() == "94c3c20100"
+
+    m = MPWrite()
+    m._write_any([1, "a"])
+    assert m.getvalue() == m.buffer.getvalue() == b"\x92\x01\xa1a"
+    assert m.buffer is m.buffer
+
+    stream = BytesIO(b"\xff")
+    stream.seek(1)
+    m = MPWrite(stream)
+    m.write_nil()
+    m._write_any([1])
+    assert m.finalize() == b"\xc0\x91\x01"
+    assert stream.getvalue() == b"\xff\xc0\x91\x01"
+
+    class Port(int):
+        pass
+
+    assert encode({"port": Port(8080)}).hex() == "81a4706f7274cd1f90"
+
+    from collections import OrderedDict
+
+    ordered: OrderedDict = OrderedDict()
+    for _ in range(5000):
+        ordered = OrderedDict([("b", ordered), ("a", 1)])
+    assert encode(ordered).hex() == "82a162" * 5000 + "80" + "a16101" * 5000
+
+    class Items(list):
+        pass
+
+    items = Items()
+    for _ in range(5000):
+        items = Items([items])
+    assert encode(items).hex() == "91" * 5000 + "90"
+
+    nested: List[object] = []
+    for _ in range(10000):
+        nested = [nested, {"k": None}]
+    assert encode(nested).hex() == "92" * 10000 + "90" + "81a16bc0" * 10000
+
+
+def test_encoder():
+    enc = Encoder()
+
+    assert enc.encode({"a": 1}).hex() == "81a16101"
+    assert enc.encode([None]).hex() == "91c0"
+    assert enc.encode("ok").hex() == "a26f6b"
+
+    out = bytearray(b"\x00")
+    enc.encode_into(True, out, -1)
+    assert out.hex() == "00c3"
+
+
+def test_make_encoder():
+    encode_record = make_encoder({"x": int, "name": str, "score": float, "tags": list})
+
+    record = {"x": 300, "name": "a" * 40, "score": 0.5, "tags": ["a", None]}
+    assert encode_record(record) == encode(record)
+    assert encode_record({**record, "extra": 1}) == encode(record)
+
+    record = {"x": "not an int", "name": None, "score": 1, "tags": False}
+    assert encode_record(record) == encode(record)
+
+    assert make_encoder({})({}) == b"\x80"
+
+    encode_record = make_encoder({"x": int, "y": int, "payload": bytes, "ok": bool})
+    assert (
+        encode_record({"x": 1, "y": 2, "payload": b"\x00\x01", "ok": False}).hex()
+        == "84a17801a17902a77061796c6f6164c4020001a26f6bc2"
     )
+    assert encode_record(
+        {"x": 1, "y": 2, "payload": bytes(300), "ok": True}
+    ).startswith(bytes.fromhex("84a17801a17902a77061796c6f6164c5012c"))
+
+    class Payload(bytes):
+        pass
+
+    for payload in (b"\x00\x01", bytes(300), bytearray(b"ab"), Payload(b"c")):
+        record = {"x": 1, "y": 2, "payload": payload, "ok": True}
+        assert encode_record(record) == encode(record)
+    assert encode([b"ab", bytearray(b"c")]).hex() == "92c4026162c40163"
@@ -1 +1,133 @@
-import pytest
\ No newline at end of file
+import threading
+from collections import OrderedDict
+
+import pytest
+
+from mp import MsgPackMarker
+from mpser import Encoder, MPWrite, encode, encode_into, make_encoder
+
+
+def test_int_errors():
+    m = MPWrite()
+
+    with pytest.raises(TypeError):
+        m.write_integer(1, MsgPackMarker.Float32)
+
+    with pytest.raises(ValueError):
+        m._write_any(2**64)
+
+    with pytest.raises(ValueError):
+        m._write_any(-(2**63) - 1)
+
+
+def test_bin_errors():
+    m = MPWrite()
+
+    with pytest.raises(ValueError):
+        m.write_bin(bytes(256), MsgPackMarker.Bin8)
+
+    with pytest.raises(ValueError):
+        m.write_str("a" * 32, MsgPackMarker.FixStr)
+
+
+def test_array_errors():
+    m = MPWrite()
+
+    with pytest.raises(ValueError):
+        m._write_array_header(0x100000000)
+
+    with pytest.raises(ValueError):
+        m._write_map_header(0x100000000)
+    assert m.finalize() == b""
+
+    floats = [i / 3 for i in range(100)]
+
+    with pytest.raises(OverflowError):
+        encode(floats + [1e300])
+
+
+def test_encode_errors():
+    out = bytearray(bytes.fromhex("ffa26162c0"))
+
+    with pytest.raises(ValueError):
+        encode_into(["ok", object()], out, -1)
+    assert out.hex() == "ffa26162c0"
+
+    with pytest.raises(ValueError):
+        encode_into(["ok", object()], out, 1)
+    assert out.hex() == "ffa26162c0"
+
+    out = bytearray(bytes.fromhex("ff0000c0"))
+
+    with pytest.raises(ValueError):
+        encode_into([object()], out, 6)
+    assert out.hex() == "ff0000c0"
+
+    with pytest.raises(ValueError):
+        encode_into(None, out, -2)
+    assert out.hex() == "ff0000c0"
+
+    with pytest.raises(TypeError):
+        MPWrite(b"")
+
+
+def test_encode_cycles():
+    cyclic_list: list = [1, "a"]
+    cyclic_list.append(cyclic_list)
+    with pytest.raises(ValueError):
+        encode(cyclic_list)
+
+    cyclic_dict: dict = {"a": 1}
+    cyclic_dict["self"] = [cyclic_dict]
+    with pytest.raises(ValueError):
+        encode(cyclic_dict)
+
+    ordered: OrderedDict = OrderedDict(a=1)
+    ordered["b"] = ordered
+    with pytest.raises(ValueError):
+        encode(ordered)
+
+    shared = [1, "a"]
+    assert encode([shared, {"x": shared}]) == encode([[1, "a"], {"x": [1, "a"]}])
+
+
+def test_encoder_errors():
+    enc = Encoder()
+
+    with pytest.raises(ValueError):
+        enc.encode(["ok", object()])
+    assert enc.encode("ok").hex() == "a26f6b"
+
+    out = bytearray(b"\x00\xc3")
+
+    with pytest.raises(ValueError):
+        enc.encode_into([object()], out, 0)
+    assert out.hex() == "00c3"
+
+
+def test_encoder_threads():
+    enc = Encoder()
+    records = [{"id": i, "name": "n" * i, "tags": [i] * i} for i in range(64)]
+    expected = [encode(r) for r in records]
+    results: dict = {}
+
+    def worker(n: int):
+        results[n] = [enc.encode(r) for r in records * 20]
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert all(res == expected * 20 for res in results.values())
+
+
+def test_make_encoder_errors():
+    encode_record = make_encoder({"x": int, "y": int, "payload": bytes, "ok": bool})
+
+    with pytest.raises(KeyError):
+        encode_record({"x": 1})
+
+    with pytest.raises(TypeError):
+        make_encoder({"when": object})